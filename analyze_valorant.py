@@ -2,25 +2,38 @@
 # -*- coding: utf-8 -*-
 """
 analyze_valorant.py
-VALORANT 이벤트 로그(JSON) -> LLM 분석 리포트 생성기 (Google AI Studio / Gemini)
+VALORANT 이벤트 로그(NDJSON 또는 JSON 배열) -> LLM 분석 리포트 생성기 (Google AI Studio / Gemini)
 - 미완성 JSON 자동 복구 + 출력 축소 + 재시도/폴백 처리
 
 필수:
-  pip install google-generativeai python-dotenv
+  pip install google-generativeai python-dotenv orjson ijson pydantic
 .env:
   GOOGLE_API_KEY=AIzaSyD-...
   MODEL_NAME=gemini-1.5-flash   # 권장
+  CACHE_DIR=~/.cache/val_coach  # (선택) 응답 캐시 위치
+  CACHE_TTL=600                 # (선택) 캐시 유효 시간(초), 0이면 캐시 끔
+  CACHE_MAX_ENTRIES=256         # (선택) 캐시 파일 최대 개수(초과 시 오래된 것부터 삭제)
 """
 
 import os
 import re
+import math
 import sys
 import json
 import time
+import hashlib
 import argparse
-from datetime import datetime
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
 
+import ijson
+import orjson
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
 from dotenv import load_dotenv
+
+from val_io import write_atomic
+
 load_dotenv()
 
 # --------- Gemini SDK -----------
@@ -32,20 +45,35 @@ except ImportError:
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 MODEL_NAME = os.getenv("MODEL_NAME", "gemini-1.5-flash")
+CACHE_DIR = os.path.expanduser(os.getenv("CACHE_DIR", "~/.cache/val_coach"))
+CACHE_TTL = int(os.getenv("CACHE_TTL", "600"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "256"))
 
 if not GOOGLE_API_KEY:
     sys.exit("[에러] GOOGLE_API_KEY가 설정되어 있지 않습니다. .env에 GOOGLE_API_KEY를 추가하세요.")
 
 genai.configure(api_key=GOOGLE_API_KEY)
 
+_MODEL_CACHE = {}
+
+def _get_model(name: str):
+    """모델 이름별 GenerativeModel을 한 번만 만들어 재시도/축약 재호출에서 재사용."""
+    model = _MODEL_CACHE.get(name)
+    if model is None:
+        model = _MODEL_CACHE[name] = genai.GenerativeModel(name)
+    return model
+
 # --------- 프롬프트 ----------
+# 프롬프트/출력 형식을 바꾸면 올려서 이전 캐시를 무효화
+PROMPT_VERSION = "2"
+
 SYSTEM_PROMPT = """너는 VALORANT 경기 로그 분석가이자 코치다.
-입력은 시간순 이벤트 배열이며 각 항목은 {ts, actor, action, target, meta} 스키마다.
+입력은 시간순 이벤트 목록(한 줄에 JSON 객체 하나)이며 각 항목은 {ts, actor, action, target, meta} 스키마다.
 한국어로 간결하고 실전적인 조언을 제공한다.
 반드시 'json' 키 하나를 가진 JSON만 출력하라. 다른 텍스트는 금지.
 """
 
-# ⚠️ 리터럴 중괄호 이스케이프( {{ }} ), 단 {events}만 실제 치환
+# printf 스타일: %(events)s만 치환 (리터럴 %는 %%로 써야 함)
 USER_PROMPT_TEMPLATE = """다음은 VALORANT 경기 이벤트 로그다.
 
 이벤트 스키마:
@@ -61,152 +89,321 @@ USER_PROMPT_TEMPLATE = """다음은 VALORANT 경기 이벤트 로그다.
    - strengths: 2개
    - mistakes: 2개 (원인과 대안 포함, 각 1문장씩)
    - checklist: 3개 (간결한 명령형, 10자 내외)
-3) highlights: 중요 순간 최대 2개 [{{ts, label, roundNum?, actor?, target?}}]
+3) highlights: 중요 순간 최대 2개 [{ts, label, roundNum?, actor?, target?}]
 4) metrics: 간단 지표(추정 가능 범위): kills/plants/defuses/rounds
 
 출력 형식(엄수): 
-{{
-  "json": {{
+{
+  "json": {
     "story": "<문단들>",
-    "coaching": {{
+    "coaching": {
       "strengths": ["...", "..."],
-      "mistakes": [{{"issue":"...","fix":"..."}}, {{"issue":"...","fix":"..."}}],
+      "mistakes": [{"issue":"...","fix":"..."}, {"issue":"...","fix":"..."}],
       "checklist": ["...", "...", "..."]
-    }},
-    "highlights": [{{"ts":"...","label":"...","roundNum":1}}],
-    "metrics": {{"kills":0,"plants":0,"defuses":0,"rounds":0}}
-  }}
-}}
-
-이벤트:
-{events}
+    },
+    "highlights": [{"ts":"...","label":"...","roundNum":1}],
+    "metrics": {"kills":0,"plants":0,"defuses":0,"rounds":0}
+  }
+}
+
+이벤트(한 줄에 하나):
+%(events)s
+"""
+
+# 파싱 실패 시 재시도용 축약 프롬프트(모듈 로드 때 한 번만 만들어 둠)
+SHORT_SYSTEM_PROMPT = SYSTEM_PROMPT + "\n\n반드시 단일 JSON만 반환. 코드펜스/설명 금지."
+SHORT_PROMPT_TEMPLATE = (
+    USER_PROMPT_TEMPLATE
+    .replace("2~3문단", "2문단")
+    .replace("strengths: 2개", "strengths: 2개 (각 10자)")
+    .replace("mistakes: 2개", "mistakes: 2개 (각 1문장, 20자 이내)")
+    .replace("checklist: 3개", "checklist: 3개 (각 10자)")
+    .replace("중요 순간 최대 2개", "중요 순간 최대 1개")
+)
+
+# 여러 매치(separator로 구분된 로그)를 한 번의 호출로 분석할 때 사용. %(matches)s만 치환
+BATCH_PROMPT_TEMPLATE = """다음은 VALORANT 경기 여러 개의 이벤트 로그다.
+matches는 한 줄에 매치 하나({id, events})이며, events는 해당 매치의 시간순 이벤트 배열이다.
+
+이벤트 스키마:
+- ts: ISO8601 타임스탬프 혹은 null
+- actor: 행위자(플레이어명 또는 SYSTEM)
+- action: 하나 (match_start, match_end, plant, defuse, kill 등)
+- target: 대상(플레이어나 Spike 등)
+- meta: 부가정보(weapon, roundNum, mapId 등)
+
+요구사항(매치마다 하나의 리포트, 출력 축소 버전):
+1) matchId: 입력의 id 그대로
+2) story: 2~3문단 서사 요약 (톤=담담, 과장 금지, 로그에 없는 가정 최소화)
+3) coaching:
+   - strengths: 2개
+   - mistakes: 2개 (원인과 대안 포함, 각 1문장씩)
+   - checklist: 3개 (간결한 명령형, 10자 내외)
+4) highlights: 중요 순간 최대 2개 [{ts, label, roundNum?, actor?, target?}]
+5) metrics: 간단 지표(추정 가능 범위): kills/plants/defuses/rounds
+
+출력 형식(엄수, reports는 입력 matches와 같은 순서):
+{
+  "json": {
+    "reports": [
+      {
+        "matchId": "...",
+        "story": "<문단들>",
+        "coaching": {
+          "strengths": ["...", "..."],
+          "mistakes": [{"issue":"...","fix":"..."}, {"issue":"...","fix":"..."}],
+          "checklist": ["...", "...", "..."]
+        },
+        "highlights": [{"ts":"...","label":"...","roundNum":1}],
+        "metrics": {"kills":0,"plants":0,"defuses":0,"rounds":0}
+      }
+    ]
+  }
+}
+
+matches(한 줄에 하나):
+%(matches)s
 """
 
 # --------- 유틸 ----------
-def load_events(path_or_dash: str):
-    """source가 '-'면 stdin, 아니면 파일에서 JSON 배열을 읽고 ts로 정렬."""
-    raw = sys.stdin.read() if path_or_dash == "-" else open(path_or_dash, "r", encoding="utf-8").read()
+MAX_EVENTS = 160   # 매치당 LLM에 보내는 최대 이벤트 수(입력 토큰 절감)
+KEEP_ACTIONS = frozenset(("match_start", "match_end", "plant", "defuse"))   # 샘플링해도 항상 유지
+
+@dataclass(slots=True)
+class Event:
+    """이벤트 한 건 {ts, actor, action, target, meta}. dict보다 작고 속성 접근이 빠름(orjson이 그대로 직렬화)."""
+    ts: str | None
+    actor: str | None
+    action: str | None
+    target: str | None
+    meta: dict | None
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Event":
+        return cls(d.get("ts"), d.get("actor"), d.get("action"), d.get("target"), d.get("meta"))
+
+def _ts_key(e: Event):
+    """
+    정렬 키: ts를 epoch 초(float)로 변환. ts가 없거나 형식이 틀리면 맨 뒤(inf).
+    tz 없는 ts는 UTC로 간주(aware/naive datetime 혼합 비교 시 TypeError 방지).
+    """
+    ts = e.ts
+    if not ts:
+        return math.inf
+    try:
+        dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return math.inf
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+def iter_events(f, ndjson: bool = False):
+    """
+    바이너리 스트림에서 이벤트를 하나씩 yield.
+    NDJSON(한 줄에 객체 하나)은 .ndjson/.jsonl 확장자이거나 첫 글자가 '{'면 자동 인식, 아니면 JSON 배열.
+    """
+    if not ndjson:
+        ndjson = f.peek(64).lstrip()[:1] == b"{"
+    if ndjson:
+        for line in f:
+            if line.strip():
+                yield orjson.loads(line)
+    else:
+        yield from ijson.items(f, "item", use_float=True)
+
+def events_to_ndjson(items) -> str:
+    """프롬프트용: 한 줄에 하나씩 공백 없이 직렬화(들여쓰기 JSON보다 토큰이 훨씬 적음)."""
+    return "\n".join(orjson.dumps(e).decode() for e in items)
+
+def load_events(path_or_dash: str, max_items: int | None = None) -> list[Event]:
+    """
+    source가 '-'면 stdin, 아니면 파일에서 이벤트(NDJSON 또는 JSON 배열)를 스트리밍으로 읽고 ts로 정렬.
+    separator(여러 매치 구분자)가 있으면 그 사이 구간별로만 정렬해 경계를 유지한다.
+    max_items를 주면 구간마다 앞 max_items//2개 + 뒤 나머지 개수 + 중간의 핵심 이벤트만
+    메모리에 남긴다(파일 전체를 올리지 않음). 생산자(val_logs_to_json / make_fake_val_log)가
+    시간순으로 저장하므로 파일 순서상 앞/뒤 = 시간상 앞/뒤.
+    """
+    f = sys.stdin.buffer if path_or_dash == "-" else open(path_or_dash, "rb")
+    n_head = max_items // 2 if max_items else None
+    n_tail = max_items - n_head if max_items else None
+
+    out = []
+    head, keep, tail = [], [], deque(maxlen=n_tail)
+
+    def flush():
+        seg = head + keep + list(tail)
+        keys = [_ts_key(e) for e in seg]
+        if any(a > b for a, b in zip(keys, keys[1:])):   # 이미 시간순이면 정렬 생략
+            seg = [seg[i] for i in sorted(range(len(seg)), key=keys.__getitem__)]
+        out.extend(seg)
+        head.clear()
+        keep.clear()
+        tail.clear()
+
     try:
-        data = json.loads(raw)
-    except json.JSONDecodeError as e:
+        for d in iter_events(f, ndjson=path_or_dash.endswith((".ndjson", ".jsonl"))):
+            e = Event.from_dict(d)
+            if e.action == "separator":
+                flush()
+                out.append(e)
+            elif n_head is None or len(head) < n_head:
+                head.append(e)
+            else:
+                if len(tail) == n_tail and tail[0].action in KEEP_ACTIONS:
+                    keep.append(tail[0])   # 뒤쪽 창에서 밀려나는 핵심 이벤트는 보존
+                tail.append(e)
+    except (ijson.JSONError, orjson.JSONDecodeError) as e:
         sys.exit(f"[에러] 이벤트 JSON 파싱 실패: {e}")
+    finally:
+        if f is not sys.stdin.buffer:
+            f.close()
+    flush()
+    return out
 
-    def _key(e):
-        ts = e.get("ts")
-        try:
-            return datetime.fromisoformat(ts.replace("Z", "+00:00")) if ts else datetime.max
-        except Exception:
-            return datetime.max
+def split_matches(events):
+    """
+    separator 기준으로 매치별로 나눠 [(match_id, events), ...] 반환.
+    match_id는 match_start의 meta.matchId → separator의 target → 순번 순으로 정함.
+    """
+    groups, seg = [], []
+    for e in events:
+        if e.action == "separator":
+            if seg:
+                groups.append((seg, e.target))
+            seg = []
+        else:
+            seg.append(e)
+    if seg:
+        groups.append((seg, None))
 
-    data.sort(key=_key)
-    return data
+    out = []
+    for i, (seg, sep_id) in enumerate(groups, start=1):
+        mid = next((
+            (e.meta or {}).get("matchId") for e in seg
+            if e.action == "match_start" and (e.meta or {}).get("matchId")
+        ), None) or sep_id or f"match{i}"
+        out.append((str(mid), seg))
+    return out
 
-def shrink_events(events, max_items=160):
-    """입력 로그가 너무 길 때 앞/뒤 위주 샘플링 + 핵심 이벤트 유지로 토큰 절감."""
-    if len(events) <= max_items:
+def shrink_events(events, max_items=MAX_EVENTS):
+    """
+    입력 로그가 너무 길 때 앞/뒤 위주 샘플링 + 핵심 이벤트 유지로 토큰 절감.
+    events는 시간순(load_events 결과)이라 한 번 훑으면서 골라 담으면 그대로 시간순.
+    """
+    n = len(events)
+    if n <= max_items:
         return events
-    head = events[:max_items//2]
-    tail = events[-max_items//2:]
-    keep = [e for e in events if e.get("action") in ("match_start", "match_end", "plant", "defuse")]
-    merged = head + keep + tail
-    # 중복 제거
-    seen, uniq = set(), []
-    for e in merged:
-        key = (e.get("ts"), e.get("actor"), e.get("action"), e.get("target"))
-        if key not in seen:
+    n_head = max_items // 2
+    tail_from = n - (max_items - n_head)
+    seen, out = set(), []
+    for i, e in enumerate(events):
+        if i < n_head or i >= tail_from or e.action in KEEP_ACTIONS:
+            key = (e.ts, e.actor, e.action, e.target)
+            if key in seen:   # 중복 제거
+                continue
             seen.add(key)
-            uniq.append(e)
-    uniq.sort(key=lambda x: x.get("ts") or "Z")
-    return uniq[:max_items]
+            out.append(e)
+            if len(out) == max_items:
+                break
+    return out
 
 # ---------- JSON 파싱/복구 도구 ----------
-def extract_top_level_json(s: str) -> str:
-    """응답 문자열에서 첫 최상위 JSON 블록만 잘라내기."""
-    if not s:
-        return s
-    s = s.strip()
-    s = re.sub(r"^```(?:json)?\s*", "", s)
-    s = re.sub(r"\s*```$", "", s)
-    start = s.find("{")
-    if start == -1:
-        return s
+_FENCE = re.compile(r"```(?:json)?")   # 코드펜스(```json / ```) 한 번에 제거
+
+def iter_top_json_spans(s: str):
+    """
+    문자열에서 최상위 {...} 블록의 (start, end) 위치를 차례로 yield.
+    블록 안의 문자열 리터럴("...", 이스케이프 포함)에 든 괄호는 깊이 계산에서 제외.
+    """
     depth = 0
-    end = None
-    for i, ch in enumerate(s[start:], start=start):
-        if ch == "{":
+    in_str = False
+    esc = False
+    start = None
+    for i, ch in enumerate(s):
+        if in_str:
+            if esc:
+                esc = False
+            elif ch == "\\":
+                esc = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = depth > 0
+        elif ch == "{":
+            if depth == 0:
+                start = i
             depth += 1
-        elif ch == "}":
+        elif ch == "}" and depth > 0:
             depth -= 1
             if depth == 0:
-                end = i + 1
-                break
-    if end is None:
+                yield start, i + 1
+
+def extract_top_level_json(s: str) -> str:
+    """응답 문자열에서 첫 최상위 JSON 블록만 잘라내기(없거나 미완성이면 펜스만 제거한 원문)."""
+    if not s:
         return s
-    return s[start:end]
+    s = _FENCE.sub("", s).strip()
+    span = next(iter_top_json_spans(s), None)
+    return s[span[0]:span[1]] if span else s
 
 def find_all_top_level_json(s: str) -> list[str]:
     """문자열에서 모든 최상위 JSON 블록을 찾아 리스트로 반환."""
-    s = s.strip()
-    s = re.sub(r"```(?:json)?", "", s)
-    s = s.replace("```", "")
-    out = []
-    depth = 0
-    start = None
-    for i, ch in enumerate(s):
-        if ch == "{":
-            if depth == 0:
-                start = i
-            depth += 1
-        elif ch == "}":
-            if depth > 0:
-                depth -= 1
-                if depth == 0 and start is not None:
-                    out.append(s[start:i+1])
-                    start = None
-    return out
+    s = _FENCE.sub("", s).strip()
+    return [s[a:b] for a, b in iter_top_json_spans(s)]
 
 def wrap_if_needed(obj):
-    """응답이 wrapper 없이 바로 본문이면 {"json": obj}로 감쌈."""
+    """응답이 wrapper 없이 바로 본문(또는 배치의 reports)이면 {"json": obj}로 감쌈."""
     if isinstance(obj, dict) and "json" not in obj:
         keys = set(obj.keys())
         expected = {"story", "coaching", "highlights", "metrics"}
-        if expected.issubset(keys):
+        if expected.issubset(keys) or isinstance(obj.get("reports"), list):
             return {"json": obj}
     return obj
 
+def _closing_suffix(s: str) -> tuple[str, bool]:
+    """
+    한 번 훑으며 문자열 리터럴 밖의 열린 {, [ 를 스택으로 추적해 닫는 데 필요한 꼬리를 반환.
+    반환: (꼬리, 마지막 문자가 문자열 안의 이스케이프 '\\'인지)
+    """
+    stack = []
+    in_str = False
+    esc = False
+    for ch in s:
+        if in_str:
+            if esc:
+                esc = False
+            elif ch == "\\":
+                esc = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch == "{":
+            stack.append("}")
+        elif ch == "[":
+            stack.append("]")
+        elif ch in "}]" and stack:
+            stack.pop()
+    return ('"' if in_str else "") + "".join(reversed(stack)), esc
+
 def naive_json_repair(trunc: str):
     """
     아주 단순한 미완성 JSON 복구:
-    - 따옴표 개수 홀수면 닫기
-    - [], {} 개수 차이만큼 닫기(두 순서 모두 시도)
+    - 열린 문자열이 있으면 닫기
+    - 열린 [], {}를 연 순서의 역순으로 닫기(한 번 훑어 스택으로 계산)
     """
     cand = extract_top_level_json(trunc).strip()
     if not cand:
         return None
 
-    # 따옴표 개수(escape 무시, 약식)
-    if cand.count('"') % 2 == 1:
-        cand += '"'
-
-    def balance(c: str):
-        opens = cand.count(c[0])
-        closes = cand.count(c[1])
-        return max(0, opens - closes)
-
-    close_braces   = balance("{}")
-    close_brackets = balance("[]")
-
-    # 시도1: ]들 먼저, 그다음 }
-    cand1 = cand + ("]" * close_brackets) + ("}" * close_braces)
-    try:
-        return json.loads(cand1)
-    except Exception:
-        pass
-
-    # 시도2: }들 먼저, 그다음 ]
-    cand2 = cand + ("}" * close_braces) + ("]" * close_brackets)
+    suffix, dangling_esc = _closing_suffix(cand)
+    if dangling_esc:
+        cand = cand[:-1]   # 잘린 이스케이프('\\')는 버림
+    if not suffix.startswith('"'):
+        cand = cand.rstrip().rstrip(",")   # 끝의 쉼표는 닫기 전에 제거
     try:
-        return json.loads(cand2)
+        return json.loads(cand + suffix)
     except Exception:
         return None
 
@@ -224,17 +421,18 @@ def try_parse_or_coerce(raw_text: str):
         return wrap_if_needed(obj)
     except Exception:
         pass
-    # 2차
-    single = extract_top_level_json(raw_text)
+    # 2차 (블록 스캔은 한 번만 하고 3차에서 재사용)
+    cands = find_all_top_level_json(raw_text)
+    single = cands[0] if cands else extract_top_level_json(raw_text)
     try:
         obj = json.loads(single)
         return wrap_if_needed(obj)
     except Exception:
         pass
-    # 3차
+    # 3차 (첫 후보는 2차에서 이미 실패)
     best = None
     best_score = -1
-    for cand in find_all_top_level_json(raw_text):
+    for cand in cands[1:]:
         try:
             obj = json.loads(cand)
         except Exception:
@@ -257,29 +455,167 @@ def try_parse_or_coerce(raw_text: str):
     repaired = naive_json_repair(raw_text)
     return repaired
 
+# ---------- 리포트 스키마 ----------
+# 출력 형식이 고정이라 스키마로 검증과 추출을 한 번에 한다(pydantic-core 컴파일 검증기).
+# 모르는 키는 그대로 보존(extra="allow"), 어긋나면 try_parse_or_coerce로 폴백.
+class _Schema(BaseModel):
+    model_config = ConfigDict(extra="allow", populate_by_name=True)
+
+class Mistake(_Schema):
+    issue: str
+    fix: str
+
+class Coaching(_Schema):
+    strengths: list[str]
+    mistakes: list[Mistake]
+    checklist: list[str]
+
+class Highlight(_Schema):
+    ts: str | None = None
+    label: str
+    roundNum: int | None = None
+    actor: str | None = None
+    target: str | None = None
+
+class Metrics(_Schema):
+    kills: int | None = None
+    plants: int | None = None
+    defuses: int | None = None
+    rounds: int | None = None
+
+class Report(_Schema):
+    matchId: str | None = None   # 배치 응답에서만 사용
+    story: str
+    coaching: Coaching
+    highlights: list[Highlight]
+    metrics: Metrics
+
+class ReportWrapper(_Schema):
+    report: Report = Field(alias="json")
+
+class BatchReports(_Schema):
+    reports: list[Report]
+
+class BatchWrapper(_Schema):
+    batch: BatchReports = Field(alias="json")
+
+def parse_report(raw_text: str, batch: bool = False):
+    """
+    {"json": ...} 형식을 스키마 고정 파서로 한 번에 검증/추출.
+    형식이 어긋나거나(코드펜스, wrapper 누락, 잘림 등) 검증 실패 시 try_parse_or_coerce로 폴백.
+    """
+    schema = BatchWrapper if batch else ReportWrapper
+    try:
+        return schema.model_validate_json(raw_text).model_dump(by_alias=True, exclude_unset=True)
+    except ValidationError:
+        return try_parse_or_coerce(raw_text)
+
+# ---------- 응답 캐시 ----------
+def cache_key(payload_text: str, model_name: str) -> str:
+    """프롬프트에 넣을 직렬화된 입력 + 모델명 + 프롬프트 버전으로 캐시 키(SHA-256) 생성."""
+    h = hashlib.sha256(payload_text.encode("utf-8"))
+    h.update(model_name.encode("utf-8"))
+    h.update(PROMPT_VERSION.encode("utf-8"))
+    return h.hexdigest()
+
+def cache_get(key: str):
+    """TTL 안의 캐시된 리포트를 반환. 없거나 만료/손상 시 None."""
+    if CACHE_TTL <= 0:
+        return None
+    path = os.path.join(CACHE_DIR, f"{key}.json")
+    try:
+        if time.time() - os.path.getmtime(path) > CACHE_TTL:
+            return None
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return None
+
+def cache_put(key: str, report) -> None:
+    """리포트를 캐시에 저장(원자적 쓰기)하고 만료/초과 항목 정리. 실패해도 무시."""
+    if CACHE_TTL <= 0:
+        return
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        write_atomic(os.path.join(CACHE_DIR, f"{key}.json"), orjson.dumps(report))
+    except OSError:
+        return
+    cache_prune()
+
+def cache_prune() -> None:
+    """TTL이 지난 캐시 파일과, CACHE_MAX_ENTRIES를 넘는 가장 오래된 파일을 삭제."""
+    now = time.time()
+    entries = []
+    try:
+        with os.scandir(CACHE_DIR) as it:
+            for de in it:
+                if de.name.endswith(".json") and de.is_file():
+                    try:
+                        entries.append((de.stat().st_mtime, de.path))
+                    except OSError:
+                        pass
+    except OSError:
+        return
+    entries.sort(reverse=True)   # 최신 순
+    for i, (mtime, path) in enumerate(entries):
+        if i >= CACHE_MAX_ENTRIES or now - mtime > CACHE_TTL:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
 # ---------- LLM 호출 ----------
-def call_gemini_json_with_retry(system_prompt: str, user_prompt: str, model_name: str, max_retries: int = 2) -> str:
+def _close_stream(resp):
+    """스트리밍 응답을 끝까지 읽지 않고 버릴 때 하부 gRPC/HTTP 스트림을 취소."""
+    it = getattr(resp, "_iterator", None)
+    for name in ("cancel", "close"):
+        fn = getattr(it, name, None)
+        if callable(fn):
+            try:
+                fn()
+            except Exception:
+                pass
+            return
+
+def call_gemini_json_with_retry(system_prompt: str, user_prompt: str, model_name: str,
+                                max_retries: int = 2, max_output_tokens: int = 800) -> str:
     """
     429(쿼터 초과) 시 retry_delay를 존중해 재시도.
     실패 시 flash로 폴백. (schema-less)
+    응답은 스트리밍으로 받으며, 최상위 JSON 객체({...})가 닫히는 즉시 스트림을 닫고 반환.
+    최상위가 배열이면 첫 원소에서 끊지 않도록 끝까지 받음.
     """
-    from google.generativeai import GenerativeModel
     attempt = 0
     curr_model = model_name
     while attempt <= max_retries:
         try:
-            model = GenerativeModel(curr_model)
+            model = _get_model(curr_model)
             resp = model.generate_content(
                 f"{system_prompt}\n\n{user_prompt}",
+                stream=True,
                 generation_config={
                     "response_mime_type": "application/json",
-                    "max_output_tokens": 800,   # ↑ 출력 끊김 방지
+                    "max_output_tokens": max_output_tokens,   # ↑ 출력 끊김 방지
                     "temperature": 0.15
                 }
             )
-            if not resp or not getattr(resp, "text", None):
+            buf = ""
+            try:
+                for chunk in resp:
+                    try:
+                        piece = chunk.text
+                    except ValueError:
+                        continue   # 텍스트 없는 청크(안전 필터/종료 신호 등)
+                    buf += piece
+                    if "}" in piece and _FENCE.sub("", buf).lstrip()[:1] == "{":
+                        span = next(iter_top_json_spans(buf), None)
+                        if span:
+                            return buf[:span[1]]
+            finally:
+                _close_stream(resp)
+            if not buf:
                 raise RuntimeError("빈 응답")
-            return resp.text
+            return buf
         except ResourceExhausted as e:
             # 429 - 쿼터 초과
             delay = 20
@@ -300,49 +636,117 @@ def call_gemini_json_with_retry(system_prompt: str, user_prompt: str, model_name
         attempt += 1
     raise RuntimeError("Gemini 호출 반복 실패")
 
-# --------- 메인 ----------
-def main():
-    ap = argparse.ArgumentParser(description="VALORANT 로그 LLM 분석기 (Gemini, robust)")
-    ap.add_argument("source", help="이벤트 JSON 경로 또는 '-'(stdin)")
-    ap.add_argument("--out", help="결과 저장 파일(.json). 미설정 시 stdout")
-    args = ap.parse_args()
-
-    events = load_events(args.source)
-    events = shrink_events(events, max_items=160)  # 입력 토큰 감소
-
-    user_prompt = USER_PROMPT_TEMPLATE.format(events=json.dumps(events, ensure_ascii=False, indent=2))
-    raw = call_gemini_json_with_retry(SYSTEM_PROMPT, user_prompt, os.getenv("MODEL_NAME", "gemini-1.5-flash"))
+def analyze(events_text: str):
+    """
+    Gemini로 분석해 리포트(dict)를 반환. 파싱 실패 시 축약 프롬프트로 한 번 더 시도.
+    events_text는 events_to_ndjson 결과(캐시 키와 두 번의 시도가 같은 문자열을 공유).
+    """
+    user_prompt = USER_PROMPT_TEMPLATE % {"events": events_text}
+    raw = call_gemini_json_with_retry(SYSTEM_PROMPT, user_prompt, MODEL_NAME)
 
-    wrapper = try_parse_or_coerce(raw)
+    wrapper = parse_report(raw)
     if not wrapper or "json" not in wrapper:
         # 축약 프롬프트로 재시도(더 짧게)
-        short_user = (
-            USER_PROMPT_TEMPLATE
-            .replace("2~3문단", "2문단")
-            .replace("strengths: 2개", "strengths: 2개 (각 10자)")
-            .replace("mistakes: 2개", "mistakes: 2개 (각 1문장, 20자 이내)")
-            .replace("checklist: 3개", "checklist: 3개 (각 10자)")
-            .replace("중요 순간 최대 2개", "중요 순간 최대 1개")
-        )
         raw2 = call_gemini_json_with_retry(
-            SYSTEM_PROMPT + "\n\n반드시 단일 JSON만 반환. 코드펜스/설명 금지.",
-            short_user.format(events=json.dumps(events, ensure_ascii=False, indent=2)),
-            os.getenv("MODEL_NAME", "gemini-1.5-flash")
+            SHORT_SYSTEM_PROMPT,
+            SHORT_PROMPT_TEMPLATE % {"events": events_text},
+            MODEL_NAME
         )
-        wrapper = try_parse_or_coerce(raw2)
+        wrapper = parse_report(raw2)
         if not wrapper or "json" not in wrapper:
             with open("gemini_raw_response.txt", "w", encoding="utf-8") as f:
                 f.write(raw2)
             sys.exit("[에러] 모델 응답 JSON 파싱 실패(재시도 포함). gemini_raw_response.txt를 확인하세요.")
 
-    report = wrapper["json"]
+    return wrapper["json"]
+
+def analyze_batch(mids: list[str], matches_text: str):
+    """
+    여러 매치를 한 번의 호출로 분석해 {match_id: 리포트} 반환.
+    matches_text는 {id, events}를 한 줄에 하나씩 직렬화한 문자열(mids와 같은 순서).
+    시스템 프롬프트/왕복 비용을 매치 수만큼 나눠 낸다. 일부 매치가 빠지면 있는 것만 반환.
+    """
+    user_prompt = BATCH_PROMPT_TEMPLATE % {"matches": matches_text}
+    raw = call_gemini_json_with_retry(
+        SYSTEM_PROMPT, user_prompt, MODEL_NAME,
+        max_output_tokens=min(800 * len(mids), 8192)
+    )
+
+    wrapper = parse_report(raw, batch=True)
+    root = wrapper.get("json") if isinstance(wrapper, dict) else None
+    reports = root.get("reports") if isinstance(root, dict) else None
+    if not isinstance(reports, list) or not reports:
+        with open("gemini_raw_response.txt", "w", encoding="utf-8") as f:
+            f.write(raw)
+        sys.exit("[에러] 모델 응답 JSON 파싱 실패(배치). gemini_raw_response.txt를 확인하세요.")
+
+    by_id = {str(r.get("matchId")): r for r in reports if isinstance(r, dict)}
+    if not set(mids) & set(by_id):
+        # matchId를 빠뜨렸으면 순서대로 대응
+        by_id = {mid: r for mid, r in zip(mids, reports) if isinstance(r, dict)}
+    return {mid: by_id[mid] for mid in mids if mid in by_id}
+
+# --------- 메인 ----------
+def main():
+    ap = argparse.ArgumentParser(description="VALORANT 로그 LLM 분석기 (Gemini, robust)")
+    ap.add_argument("source", help="이벤트 로그(.ndjson 또는 JSON 배열) 경로 또는 '-'(stdin)")
+    ap.add_argument("--out", help="결과 저장 파일(.json). 미설정 시 stdout")
+    ap.add_argument("--no-cache", action="store_true", help="응답 캐시를 읽지 않고 항상 새로 호출")
+    args = ap.parse_args()
+
+    events = load_events(args.source, max_items=MAX_EVENTS)
+    matches = split_matches(events)
+    if len(matches) > 1:
+        run_batch(matches, args)
+        return
+    events = shrink_events(events, max_items=MAX_EVENTS)  # 입력 토큰 감소
+    events_text = events_to_ndjson(events)   # 한 번만 직렬화해 캐시 키/프롬프트에 공용
+
+    key = cache_key(events_text, MODEL_NAME)
+    report = None if args.no_cache else cache_get(key)
+    if report is not None:
+        print(f"[캐시] hit {key[:12]}", file=sys.stderr)
+    else:
+        print(f"[캐시] miss {key[:12]}", file=sys.stderr)
+        report = analyze(events_text)
+        cache_put(key, report)
 
     if args.out:
-        with open(args.out, "w", encoding="utf-8") as f:
-            json.dump(report, f, ensure_ascii=False, indent=2)
+        write_atomic(args.out, orjson.dumps(report, option=orjson.OPT_INDENT_2))
         print(f"[완료] {args.out} 저장")
     else:
-        print(json.dumps(report, ensure_ascii=False, indent=2))
+        print(orjson.dumps(report, option=orjson.OPT_INDENT_2).decode())
+
+def run_batch(matches, args):
+    """separator로 구분된 여러 매치를 한 번에 분석하고 매치별 리포트로 나눠 저장."""
+    mids = [mid for mid, _ in matches]
+    matches_text = events_to_ndjson(
+        {"id": mid, "events": shrink_events(evs, max_items=MAX_EVENTS)} for mid, evs in matches
+    )
+
+    key = cache_key(matches_text, MODEL_NAME)
+    reports = None if args.no_cache else cache_get(key)
+    if reports is not None:
+        print(f"[캐시] hit {key[:12]}", file=sys.stderr)
+    else:
+        print(f"[캐시] miss {key[:12]} (매치 {len(mids)}개 배치)", file=sys.stderr)
+        reports = analyze_batch(mids, matches_text)
+        if all(mid in reports for mid in mids):
+            cache_put(key, reports)
+
+    for mid in mids:
+        if mid not in reports:
+            print(f"[경고] match {mid} 리포트가 응답에 없습니다.", file=sys.stderr)
+
+    if args.out:
+        # report.json → report_<matchId>.json
+        stem, ext = os.path.splitext(args.out)
+        for mid, report in reports.items():
+            path = f"{stem}_{mid}{ext or '.json'}"
+            write_atomic(path, orjson.dumps(report, option=orjson.OPT_INDENT_2))
+            print(f"[완료] {path} 저장")
+    else:
+        print(orjson.dumps(reports, option=orjson.OPT_INDENT_2).decode())
 
 if __name__ == "__main__":
     main()
@@ -3,19 +3,25 @@
 """
 make_fake_val_log.py
 VALORANT 스타일의 가짜 이벤트 로그 생성기
-- 출력(JSON 배열): [{ts, actor, action, target, meta}, ...]
+- 출력(NDJSON, 한 줄에 이벤트 하나): {ts, actor, action, target, meta}
+  (--out을 .json으로 주면 기존처럼 JSON 배열)
 - story/analyze 파이프라인 테스트용 (Riot API 없이 사용)
 
+필요:
+  pip install numpy orjson
+
 사용 예:
   python make_fake_val_log.py
-  python make_fake_val_log.py --rounds 10 --seed 42 --out sample.json
+  python make_fake_val_log.py --rounds 10 --seed 42 --out sample.ndjson
 """
 
-import json
-import random
 import argparse
 from datetime import datetime, timezone, timedelta
 
+import numpy as np
+
+from val_io import write_events
+
 WEAPONS = [
     "Vandal", "Phantom", "Operator", "Spectre", "Bulldog",
     "Sheriff", "Ghost", "Classic", "Judge", "Marshal"
@@ -31,15 +37,15 @@ def iso(dt: datetime) -> str:
     return dt.astimezone(timezone.utc).isoformat()
 
 def gen_events(rounds: int, seed: int | None = None) -> list[dict]:
-    if seed is not None:
-        random.seed(seed)
+    rounds = max(rounds, 0)   # 음수면 numpy 배열 크기 오류 → 라운드 없는 매치로 취급
+    rng = np.random.default_rng(seed)
 
     events = []
     # 기준 시간(최근 20~35분 사이 시작)
-    start = datetime.now(timezone.utc) - timedelta(minutes=random.randint(20, 35))
-    map_id = random.choice(MAPS)
-    queue_id = random.choice(QUEUES)
-    match_id = f"FAKE-{random.randint(100000, 999999)}"
+    start = datetime.now(timezone.utc) - timedelta(minutes=int(rng.integers(20, 36)))
+    map_id = MAPS[rng.integers(len(MAPS))]
+    queue_id = QUEUES[rng.integers(len(QUEUES))]
+    match_id = f"FAKE-{rng.integers(100000, 1000000)}"
 
     # 매치 시작
     events.append({
@@ -50,54 +56,64 @@ def gen_events(rounds: int, seed: int | None = None) -> list[dict]:
         "meta": {"mapId": map_id, "matchId": match_id}
     })
 
+    # 라운드별 난수를 미리 한 번에 뽑아 둠(킬은 라운드당 최대 4회분). 루프에서는 꺼내 쓰기만 함
+    prep_gaps     = rng.integers(10, 21, rounds).tolist()        # 라운드 준비 시간
+    plant_mask    = (rng.random(rounds) < 0.7).tolist()          # 스파이크 설치 여부
+    planters      = rng.integers(0, len(ATTACKERS), rounds).tolist()
+    plant_delays  = rng.integers(12, 31, rounds).tolist()
+    n_kills       = rng.integers(1, 5, rounds).tolist()          # 라운드당 킬 1~4회
+    kill_gaps     = rng.integers(4, 13, (rounds, 4)).tolist()
+    atk_kills     = (rng.random((rounds, 4)) < 0.5).tolist()     # 공격측이 킬했는지
+    killer_u      = rng.random((rounds, 4)).tolist()             # [0,1) → 진영 내 인덱스로 변환
+    victim_u      = rng.random((rounds, 4)).tolist()
+    weapons       = rng.integers(0, len(WEAPONS), (rounds, 4)).tolist()
+    defuse_mask   = (rng.random(rounds) < 0.35).tolist()         # 해제 여부(설치 시에만 의미)
+    defusers      = rng.integers(0, len(DEFENDERS), rounds).tolist()
+    defuse_delays = rng.integers(5, 13, rounds).tolist()
+    atk_wins      = (rng.random(rounds) < 0.5).tolist()          # 설치 없을 때 50:50
+    post_gaps     = rng.integers(6, 16, rounds).tolist()         # 라운드 간 간격
+
     t = start
-    atk, defn = ATTACKERS[:], DEFENDERS[:]
+    atk, defn = ATTACKERS, DEFENDERS
     atk_score = 0
     def_score = 0
 
-    for r in range(1, rounds + 1):
+    for i in range(rounds):
+        r = i + 1
         # 라운드 준비 시간
-        t += timedelta(seconds=random.randint(10, 20))
+        t += timedelta(seconds=prep_gaps[i])
 
-        # (공격측 기준) 스파이크 설치 확률
-        plant_happened = random.random() < 0.7
+        # (공격측 기준) 스파이크 설치
+        plant_happened = plant_mask[i]
         if plant_happened:
-            planter = random.choice(atk)
-            t += timedelta(seconds=random.randint(12, 30))
+            t += timedelta(seconds=plant_delays[i])
             events.append({
                 "ts": iso(t),
-                "actor": planter,
+                "actor": atk[planters[i]],
                 "action": "plant",
                 "target": "Spike",
                 "meta": {"roundNum": r}
             })
 
         # 킬 이벤트 (라운드당 1~4회)
-        for _ in range(random.randint(1, 4)):
-            t += timedelta(seconds=random.randint(4, 12))
-            killer_side = atk if random.random() < 0.5 else defn
-            victim_side = defn if killer_side is atk else atk
-            if not victim_side:
-                break
-            killer = random.choice(killer_side)
-            victim = random.choice([v for v in victim_side if v != killer] or [random.choice(victim_side)])
-            weapon = random.choice(WEAPONS)
+        for k in range(n_kills[i]):
+            t += timedelta(seconds=kill_gaps[i][k])
+            killer_side, victim_side = (atk, defn) if atk_kills[i][k] else (defn, atk)
             events.append({
                 "ts": iso(t),
-                "actor": killer,
+                "actor": killer_side[int(killer_u[i][k] * len(killer_side))],
                 "action": "kill",
-                "target": victim,
-                "meta": {"weapon": weapon, "roundNum": r}
+                "target": victim_side[int(victim_u[i][k] * len(victim_side))],
+                "meta": {"weapon": WEAPONS[weapons[i][k]], "roundNum": r}
             })
 
         # 해제 시도 (설치가 있었을 때만, 확률 35%)
-        defuse_happened = plant_happened and (random.random() < 0.35)
+        defuse_happened = plant_happened and defuse_mask[i]
         if defuse_happened:
-            defuser = random.choice(defn)
-            t += timedelta(seconds=random.randint(5, 12))
+            t += timedelta(seconds=defuse_delays[i])
             events.append({
                 "ts": iso(t),
-                "actor": defuser,
+                "actor": defn[defusers[i]],
                 "action": "defuse",
                 "target": "Spike",
                 "meta": {"roundNum": r}
@@ -108,15 +124,14 @@ def gen_events(rounds: int, seed: int | None = None) -> list[dict]:
             atk_score += 1
         elif defuse_happened:
             def_score += 1
-        else:
+        elif atk_wins[i]:
             # 설치 없었으면 50:50
-            if random.random() < 0.5:
-                atk_score += 1
-            else:
-                def_score += 1
+            atk_score += 1
+        else:
+            def_score += 1
 
         # 라운드 간 간격
-        t += timedelta(seconds=random.randint(6, 15))
+        t += timedelta(seconds=post_gaps[i])
 
     # 매치 종료
     t += timedelta(seconds=5)
@@ -128,20 +143,20 @@ def gen_events(rounds: int, seed: int | None = None) -> list[dict]:
         "meta": {"teams": [{"teamId": "Attackers", "score": atk_score}, {"teamId": "Defenders", "score": def_score}]}
     })
 
-    # 시간 순 정렬
-    events.sort(key=lambda e: (e["ts"] or "Z"))
+    # t는 단조 증가하므로 이미 시간순(정렬 불필요)
     return events
 
 def main():
     ap = argparse.ArgumentParser(description="가짜 VALORANT 이벤트 로그 생성기")
     ap.add_argument("--rounds", type=int, default=8, help="라운드 수 (기본 8)")
     ap.add_argument("--seed", type=int, help="랜덤 시드 (재현성)")
-    ap.add_argument("--out", default="sample.json", help="저장 파일명 (기본 sample.json)")
+    ap.add_argument("--out", default="sample.ndjson", help="저장 파일명 (기본 sample.ndjson, .json이면 JSON 배열)")
     args = ap.parse_args()
+    if args.rounds < 0:
+        ap.error("--rounds는 0 이상이어야 합니다.")
 
     events = gen_events(args.rounds, args.seed)
-    with open(args.out, "w", encoding="utf-8") as f:
-        json.dump(events, f, ensure_ascii=False, indent=2)
+    write_events(args.out, events)
     print(f"[완료] {args.out} 생성됨 (라운드 {args.rounds}, 시드 {args.seed})")
 
 if __name__ == "__main__":
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+val_io.py
+이벤트 로그/리포트 저장 공용 함수 (analyze_valorant.py, val_logs_to_json.py / make_fake_val_log.py에서 사용)
+
+필요:
+  pip install orjson
+"""
+
+import os
+
+import orjson
+
+def write_atomic(path: str, data: bytes) -> None:
+    """임시 파일에 한 번에 쓴 뒤 os.replace로 교체. 중간에 죽어도 반쯤 쓴 파일이 남지 않음."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+def write_events(path: str, events: list[dict]):
+    """확장자가 .ndjson/.jsonl이면 한 줄에 이벤트 하나(NDJSON), 아니면 JSON 배열로 저장."""
+    if path.endswith((".ndjson", ".jsonl")):
+        data = b"".join(orjson.dumps(e, option=orjson.OPT_APPEND_NEWLINE) for e in events)
+    else:
+        data = orjson.dumps(events, option=orjson.OPT_INDENT_2)
+    write_atomic(path, data)
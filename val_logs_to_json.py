@@ -3,10 +3,10 @@
 """
 VALORANT 매치 → 이벤트 JSON 생성기
 - Riot API에서 Riot ID → PUUID → 활성 샤드 → 최근 매치 → 매치 상세를 조회
-- 스파이크 plant/defuse, kill, match_start/end 이벤트를 추출해 시간순 JSON으로 저장
+- 스파이크 plant/defuse, kill, match_start/end 이벤트를 추출해 시간순 NDJSON(한 줄에 이벤트 하나)으로 저장
 
 필요:
-  pip install requests python-dotenv
+  pip install requests aiohttp orjson python-dotenv
 
 .env 예시:
   RIOT_API_KEY=RGAPI-xxxxxxxxxxxxxxxxxxxxxxxxxxxx
@@ -16,13 +16,19 @@ VALORANT 매치 → 이벤트 JSON 생성기
 
 import os
 import sys
-import json
 import time
+import asyncio
+import threading
 import argparse
+import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime, timezone
 from dotenv import load_dotenv
 
+from val_io import write_events
+
 load_dotenv()
 
 API_KEY    = os.getenv("RIOT_API_KEY")
@@ -30,22 +36,79 @@ ACCOUNT_RT = os.getenv("ACCOUNT_ROUTE", "asia")   # americas/europe/asia
 VAL_REGION = os.getenv("VAL_REGION", "kr")        # kr/ap/na/eu/... (활성 샤드로 런타임에 덮어씀)
 
 HDR = {"X-Riot-Token": API_KEY}
+MAX_CONCURRENCY = 5   # 매치 상세 동시 요청 수
+RATE_LIMITS = [(20, 1), (100, 120)]   # (요청 수, 초): 개발용 키 기준 20회/1초, 100회/2분
+RETRY_STATUSES = (429, 500, 502, 503, 504)   # 동기/비동기 요청 모두 이 상태 코드에서 재시도
+
+# 동기 조회용 세션: 같은 호스트로 가는 요청끼리 TCP/TLS 연결 재사용.
+# 429/5xx는 Retry-After(없으면 지수 백오프)를 지켜 최대 2번 재시도.
+SESSION = requests.Session()
+SESSION.headers.update(HDR)
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=8,
+    pool_maxsize=8,
+    max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=RETRY_STATUSES,
+                      raise_on_status=False),
+))
 
 def die(msg: str):
     print(f"[에러] {msg}", file=sys.stderr)
     sys.exit(1)
 
+class RiotError(Exception):
+    """Riot API가 200이 아닌 응답을 돌려줌. 코루틴 안에서는 die() 대신 이걸 던짐."""
+
+    def __init__(self, status: int, text: str):
+        super().__init__(f"{status} {text[:400]}")
+        self.status = status
+        self.text = text
+
+class TokenBucket:
+    """per초마다 capacity개씩 채워지는 토큰 버킷. 동기/비동기 요청이 같은 버킷을 공유."""
+
+    def __init__(self, capacity: int, per: float):
+        self.capacity = capacity
+        self.rate = capacity / per
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """토큰 하나를 예약하고, 그 토큰이 채워질 때까지 기다려야 하는 시간(초)을 반환."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+BUCKETS = [TokenBucket(n, per) for n, per in RATE_LIMITS]
+
+def rate_wait() -> float:
+    """모든 속도 제한을 지키려면 기다려야 하는 시간(초)."""
+    return max(b.reserve() for b in BUCKETS)
+
 def rget(url: str, params=None):
-    """GET + 간단한 429 재시도."""
-    r = requests.get(url, headers=HDR, params=params, timeout=20)
-    if r.status_code == 429:
-        retry = int(r.headers.get("Retry-After", "2"))
-        time.sleep(retry)
-        r = requests.get(url, headers=HDR, params=params, timeout=20)
+    """GET (공유 세션, 429/5xx 재시도는 어댑터가 처리)."""
+    time.sleep(rate_wait())
+    r = SESSION.get(url, params=params, timeout=20)
     if r.status_code != 200:
         die(f"{r.status_code} {r.text[:400]}")
     return r.json()
 
+async def aget(session: aiohttp.ClientSession, url: str, params=None, max_retries: int = 3):
+    """비동기 GET. 429/5xx는 Retry-After(없으면 지수 백오프)를 지켜 재시도, 실패하면 RiotError."""
+    for attempt in range(max_retries + 1):
+        await asyncio.sleep(rate_wait())
+        async with session.get(url, params=params) as r:
+            if r.status == 200:
+                return await r.json()
+            text = await r.text()
+            if r.status not in RETRY_STATUSES or attempt == max_retries:
+                raise RiotError(r.status, text)
+            retry_after = r.headers.get("Retry-After")
+        await asyncio.sleep(float(retry_after) if retry_after else 0.5 * 2 ** attempt)
+
 # -------------------- 계정/샤드 조회 --------------------
 
 def get_puuid(game_name: str, tag_line: str) -> str:
@@ -69,10 +132,19 @@ def get_recent_match_ids_by_puuid(puuid: str, shard: str, count: int = 3):
     ids = [m["matchId"] for m in j.get("history", [])]
     return ids[:count]
 
-def get_match_detail(match_id: str, shard: str):
-    """매치 상세"""
+async def get_match_detail_async(session: aiohttp.ClientSession, sem: asyncio.Semaphore, match_id: str, shard: str):
+    """매치 상세 (동시 요청 수는 sem으로 제한)"""
     url = f"https://{shard}.api.riotgames.com/val/match/v1/matches/{match_id}"
-    return rget(url)
+    async with sem:
+        print(f"[정보] match {match_id} 상세 가져오는 중…")
+        return await aget(session, url)
+
+async def get_match_details(match_ids: list[str], shard: str):
+    """매치 상세 여러 개를 동시에 조회. 결과 순서는 match_ids와 같음."""
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+    timeout = aiohttp.ClientTimeout(total=20)
+    async with aiohttp.ClientSession(headers=HDR, timeout=timeout) as session:
+        return await asyncio.gather(*(get_match_detail_async(session, sem, mid, shard) for mid in match_ids))
 
 # -------------------- 유틸/추출 --------------------
 
@@ -93,7 +165,7 @@ def extract_events_from_match(md: dict):
     """
     events = []
     info    = md.get("matchInfo", {}) or {}
-    players = {p["puuid"]: p for p in md.get("players", [])}
+    name_by_puuid = {p["puuid"]: p.get("gameName") for p in md.get("players", [])}
     rounds  = md.get("roundResults", []) or []
 
     # 매치 시작
@@ -115,7 +187,7 @@ def extract_events_from_match(md: dict):
         plant = rr.get("plantRoundTime")
         if plant is not None:
             planter_p = (rr.get("plantPlayerLocations") or [{}])[0].get("puuid")
-            actor = players.get(planter_p, {}).get("gameName") or planter_p or "Unknown"
+            actor = name_by_puuid.get(planter_p) or planter_p or "Unknown"
             events.append({
                 "ts": as_ts(base + plant),
                 "actor": actor,
@@ -128,7 +200,7 @@ def extract_events_from_match(md: dict):
         defuse = rr.get("defuseRoundTime")
         if defuse is not None:
             defuser_p = (rr.get("defusePlayerLocations") or [{}])[0].get("puuid")
-            actor = players.get(defuser_p, {}).get("gameName") or defuser_p or "Unknown"
+            actor = name_by_puuid.get(defuser_p) or defuser_p or "Unknown"
             events.append({
                 "ts": as_ts(base + defuse),
                 "actor": actor,
@@ -139,10 +211,11 @@ def extract_events_from_match(md: dict):
 
         # kills
         for ps in rr.get("playerStats", []):
-            killer_name = players.get(ps.get("puuid",""), {}).get("gameName") or ps.get("puuid","Unknown")
+            killer_p    = ps.get("puuid")
+            killer_name = name_by_puuid.get(killer_p) or killer_p or "Unknown"
             for k in ps.get("kills", []):
                 victim_p = k.get("victim")
-                victim   = players.get(victim_p, {}).get("gameName") or victim_p or "Unknown"
+                victim   = name_by_puuid.get(victim_p) or victim_p or "Unknown"
                 ts_ms    = k.get("timeSinceGameStartMillis")
                 weap     = (k.get("finishingDamage") or {}).get("damageItem") or "weapon"
                 events.append({
@@ -173,7 +246,7 @@ def main():
     ap = argparse.ArgumentParser(description="VALORANT → 이벤트 JSON 생성기 (활성 샤드 자동 감지)")
     ap.add_argument("--riot-id", required=True, help='예: GameName#KR1')
     ap.add_argument("--count", type=int, default=1, help="최근 매치 n개 (기본 1)")
-    ap.add_argument("--out", default="sample.json", help="저장 파일명 (기본 sample.json)")
+    ap.add_argument("--out", default="sample.ndjson", help="저장 파일명 (기본 sample.ndjson, .json이면 JSON 배열)")
     args = ap.parse_args()
 
     if not API_KEY:
@@ -200,18 +273,19 @@ def main():
     if not mids:
         die("매치 기록이 없습니다. (비공개 계정이거나 최근 전적 없음)")
 
+    try:
+        details = asyncio.run(get_match_details(mids, shard))
+    except RiotError as e:
+        die(str(e))
+
     all_events = []
-    for mid in mids:
-        print(f"[정보] match {mid} 상세 가져오는 중…")
-        md = get_match_detail(mid, shard)
+    for mid, md in zip(mids, details):
         evs = extract_events_from_match(md)
         all_events.extend(evs + [{"ts": None, "actor": "SYSTEM", "action": "separator", "target": mid, "meta": {}}])
-        time.sleep(1)  # rate limit 여유
     if all_events and all_events[-1]["action"] == "separator":
         all_events.pop()
 
-    with open(args.out, "w", encoding="utf-8") as f:
-        json.dump(all_events, f, ensure_ascii=False, indent=2)
+    write_events(args.out, all_events)
     print(f"[완료] {args.out} 저장. 다음 실행 예:")
     print(f"  python analyze_valorant.py {args.out} --out report.json")
 